@@ -1,16 +1,16 @@
 # pre.py
 """Tools for preprocessing data."""
 
+import weakref as _weakref
 import numpy as _np
+from numpy.lib.stride_tricks import sliding_window_view as _sliding_window_view
 from scipy import linalg as _la
 from scipy.linalg import svd as _svd
 from scipy.sparse import linalg as _spla
-from sklearn.utils import extmath as _sklmath
-from matplotlib import pyplot as _plt
 
 
 # Basis computation ===========================================================
-def mean_shift(X):
+def mean_shift(X, inplace=False):
     """Compute the mean of the columns of X, then use it to shift the columns
     so that they have mean zero.
 
@@ -19,6 +19,10 @@ def mean_shift(X):
     X : (n,k) ndarray
         A matrix of k snapshots. Each column is a single snapshot.
 
+    inplace : bool
+        If True, overwrite X with the shifted data instead of allocating a
+        new (n,k) array. X must have a floating point data type.
+
     Returns
     -------
     xbar : (n,) ndarray
@@ -27,17 +31,153 @@ def mean_shift(X):
 
     Xshifted : (n,k) ndarray
         The matrix such that Xshifted[:,j] + xbar = X[:,j] for j=1,2,...,k.
+        If inplace=True, this is X itself.
     """
-    # Check dimensions.
+    # Check dimensions and data type.
     if X.ndim != 2:
         raise ValueError("data X must be two-dimensional")
+    if inplace and X.dtype.kind != 'f':
+        raise TypeError("data X must be floating point to shift in place")
 
     xbar = _np.mean(X, axis=1)               # Compute the mean column.
-    Xshifted = X - xbar.reshape((-1,1))     # Shift the columns by the mean.
+    if inplace:                             # Shift the columns by the mean.
+        X -= xbar.reshape((-1,1))
+        return xbar, X
+    Xshifted = X - xbar.reshape((-1,1))
     return xbar, Xshifted
 
 
-def pod_basis(X, r, mode="simple", **options):
+# The most recent randomized sketch computed with cache=True, see
+# _randomized_svd(). Keys: "X" (weak reference), "shape", "fingerprint",
+# "n_iter", "random_state", "Q", and "B".
+_SKETCH_CACHE = {}
+
+
+def _clear_sketch_cache(ref):
+    """Empty _SKETCH_CACHE when the array it refers to (through the weak
+    reference ref) is garbage collected, so Q and B do not outlive it.
+    """
+    if _SKETCH_CACHE.get("X") is ref:
+        _SKETCH_CACHE.clear()
+
+
+def _fingerprint(X, samples=8):
+    """Return a copy of a grid of roughly samples x samples evenly spaced
+    entries of the two-dimensional array X, used to detect in-place changes
+    to X between calls. Only the sampled entries are copied, even if X is a
+    non-contiguous view.
+    """
+    n,k = X.shape
+    return X[::max(1, n // samples), ::max(1, k // samples)].copy()
+
+
+def _cached_sketch(X, l, n_iter, random_state):
+    """Return the cached (Q, B) from _randomized_svd() if it was computed from
+    the same (unchanged) X with at least l columns, at least n_iter power
+    iterations (any number if n_iter is None), and the same random_state
+    (any if random_state is None), otherwise None.
+    """
+    cache = _SKETCH_CACHE
+    if not cache or cache["X"]() is not X or cache["shape"] != X.shape:
+        return None
+    if cache["Q"].shape[1] < l or (n_iter is not None
+                                   and cache["n_iter"] < n_iter):
+        return None
+    seed = cache["random_state"]
+    if random_state is not None and random_state is not seed and not (
+            isinstance(random_state, (int, _np.integer))
+            and isinstance(seed, (int, _np.integer)) and random_state == seed):
+        return None
+    if not _np.array_equal(cache["fingerprint"], _fingerprint(X)):
+        return None
+    return cache["Q"], cache["B"]
+
+
+def _sketch_dtype(X):
+    """Return the data type to use for a randomized sketch of X: float32 if X
+    is float32 (to halve the memory traffic of the sketch), else float64.
+    """
+    return _np.float32 if X.dtype == _np.float32 else _np.float64
+
+
+def _randomized_svd(X, r, n_oversamples=10, n_iter="auto", random_state=None,
+                    cache=False):
+    """Compute an approximate truncated SVD of X with a randomized range finder
+    and power iterations (Halko, Martinsson, and Tropp 2011, Alg. 4.4 / 5.1).
+
+    Parameters
+    ----------
+    X : (n,k) ndarray
+        The matrix to decompose.
+
+    r : int
+        The number of singular values / vectors to compute.
+
+    n_oversamples : int
+        The number of extra random samples used to sketch the range of X.
+
+    n_iter : int or "auto"
+        The number of power iterations. If "auto", use 7 if r is less than 10%
+        of min(n,k) and 4 otherwise (the same rule as scikit-learn).
+
+    random_state : None, int, or numpy.random.Generator
+        Seed or generator for drawing the random test matrix.
+
+    cache : bool
+        If True, store the orthonormal sketch Q and B = Q^T X, and reuse them
+        in later calls with the same X (and at most as many columns and power
+        iterations, unless n_iter="auto"), so only the small SVD of B is
+        recomputed. This is useful for sweeping over r. A cached sketch is
+        only reused for the same random_state, except that random_state=None
+        reuses any cached sketch. In-place changes to X are detected by
+        sampling a few of its entries, so some modifications of X may go
+        undetected. The cache is emptied when X is garbage collected.
+
+    Returns
+    -------
+    U : (n,r) ndarray
+        The approximate first r left singular vectors of X. If X is float32,
+        the sketch and U are float32, but B = Q^T X is decomposed in float64.
+
+    s : (r,) ndarray
+        The approximate first r singular values of X.
+
+    Vt : (r,k) ndarray
+        The approximate first r (transposed) right singular vectors of X.
+    """
+    n,k = X.shape
+    l = min(r + n_oversamples, n, k)
+    sketch = None
+    if cache:
+        sketch = _cached_sketch(X, l, None if n_iter == "auto" else n_iter,
+                                random_state)
+    if n_iter == "auto":
+        n_iter = 7 if r < .1*min(n,k) else 4
+    if sketch is not None:
+        Q, B = sketch
+    else:
+        rng = _np.random.default_rng(random_state)
+        Omega = rng.standard_normal((k,l), dtype=_sketch_dtype(X))
+
+        # Sketch the range of X, re-orthonormalizing between power iterations.
+        Q = _la.qr(X @ Omega, mode="economic")[0]
+        for _ in range(n_iter):
+            Q = _la.qr(X.T @ Q, mode="economic")[0]
+            Q = _la.qr(X @ Q, mode="economic")[0]
+        B = (Q.T @ X).astype(_np.float64)
+        if cache:
+            _SKETCH_CACHE.clear()
+            _SKETCH_CACHE.update(X=_weakref.ref(X, _clear_sketch_cache),
+                                 shape=X.shape, fingerprint=_fingerprint(X),
+                                 n_iter=n_iter, random_state=random_state,
+                                 Q=Q, B=B)
+
+    # Compute the SVD of the small projected matrix B = Q^T X.
+    Ub, s, Vt = _la.svd(B, full_matrices=False)
+    return Q @ Ub[:,:r].astype(Q.dtype), s[:r], Vt[:r]
+
+
+def pod_basis(X, r, mode="randomized", **options):
     """Compute the POD basis of rank r corresponding to the data in X.
     This function does NOT shift or scale the data before computing the basis.
 
@@ -51,38 +191,162 @@ def pod_basis(X, r, mode="simple", **options):
 
     mode : str
         The strategy to use for computing the truncated SVD of X. Options:
-        * "simple" (default): Use scipy.linalg.svd() to compute the entire SVD
-            of X, then truncate it to get the first r left singular vectors of
-            X. May be inefficient for very large matrices.
+        * "randomized" (default): Compute an approximate SVD with a randomized
+            range finder and power iterations. This costs O(nk(r+p)) for
+            p oversamples and is much faster than "simple" when r is much
+            smaller than min(n,k), at the cost of some accuracy.
+        * "simple": Use scipy.linalg.svd() to compute the economic SVD of X
+            (with the divide-and-conquer LAPACK driver 'gesdd'), then
+            truncate it to get the first r left singular vectors of X. May be
+            inefficient for very large matrices.
         * "arpack": Use scipy.sparse.linalg.svds() to compute only the first r
-            left singular vectors of X. This uses ARPACK for the eigensolver.
-        * "randomized": Compute an approximate SVD with a randomized approach
-            using sklearn.utils.extmath.randomized_svd(). This gives faster
-            results at the cost of some accuracy.
+            left singular vectors of X. This uses ARPACK for the eigensolver by
+            default; pass solver="lobpcg" (SciPy >= 1.4) or solver="propack"
+            (SciPy >= 1.8) to use another solver. PROPACK works on dense
+            arrays and is often faster than ARPACK when r is a small but
+            nontrivial fraction of min(n,k).
 
     options
         Additional parameters for the SVD solver, which depends on `mode`:
+        * "randomized": n_oversamples (int, default 10), the number of extra
+            samples for the sketch; n_iter (int or "auto", default "auto"),
+            the number of power iterations; random_state (None, int, or
+            numpy.random.Generator), the seed for the random sketch; and
+            cache (bool, default False), whether to store the sketch of X and
+            reuse it in later calls with the same X and smaller r.
         * "simple": scipy.linalg.svd()
-        * "arpack": scipy.sparse.linalg.svds()
-        * "randomized": sklearn.utils.extmath.randomized_svd()
+        * "arpack": scipy.sparse.linalg.svds(), e.g., solver (only passed to
+            svds() if given, so the default works with SciPy < 1.4). Only the
+            left singular vectors are computed unless return_singular_vectors
+            is specified.
 
     Returns
     -------
     Vr : (n,r) ndarray
         The first r POD basis vectors of X. Each column is one basis vector.
     """
-    if mode == "simple":
+    if mode == "randomized":
+        return _randomized_svd(X, r, **options)[0]
+    elif mode == "simple":
+        options.setdefault("lapack_driver", "gesdd")
         return _la.svd(X, full_matrices=False, **options)[0][:,:r]
-    if mode == "arpack":
+    elif mode == "arpack":
+        options.setdefault("return_singular_vectors", "u")
         return _spla.svds(X, r, which="LM", **options)[0][:,::-1]
-    elif mode == "randomized":
-        return _sklmath.randomized_svd(X, r, **options)[0][:,::-1]
     else:
         raise NotImplementedError(f"invalid mode '{mode}'")
 
 
+def pod_basis_centered(X, r, n_oversamples=10, n_iter="auto", block=4096,
+                       random_state=None):
+    """Compute the mean of the columns of X and the POD basis of rank r of the
+    mean-shifted data with a randomized SVD, without forming the shifted data.
+    This is equivalent to (but uses less memory and fewer passes over X than)
+
+        xbar, Xshifted = mean_shift(X)
+        Vr = pod_basis(Xshifted, r, mode="randomized", n_iter=n_iter)
+
+    The mean and the random sketch of the shifted data are computed together
+    in a single pass over column blocks of X, using the identity
+    (X - xbar 1^T) Omega = X Omega - xbar (1^T Omega). The shift is applied
+    implicitly in the same way in the power iterations.
+
+    Parameters
+    ----------
+    X : (n,k) ndarray
+        A matrix of k snapshots. Each column is a single snapshot.
+
+    r : int
+        The number of POD basis vectors to compute.
+
+    n_oversamples : int
+        The number of extra random samples used to sketch the range of X.
+
+    n_iter : int or "auto"
+        The number of power iterations. If "auto", use 7 if r is less than 10%
+        of min(n,k) and 4 otherwise (the same rule as pod_basis()).
+
+    block : int
+        The number of columns of X to process at a time in the first pass.
+
+    random_state : None, int, or numpy.random.Generator
+        Seed or generator for drawing the random test matrix.
+
+    Returns
+    -------
+    xbar : (n,) ndarray
+        The mean snapshot.
+
+    Vr : (n,r) ndarray
+        The first r POD basis vectors of the mean-shifted data. Each column is
+        one basis vector. If X is float32, xbar, Vr, and the sketch are
+        float32, but the final small SVD is computed in float64.
+    """
+    # Check dimensions.
+    if X.ndim != 2:
+        raise ValueError("data X must be two-dimensional")
+
+    n,k = X.shape
+    l = min(r + n_oversamples, n, k)
+    dtype = _sketch_dtype(X)
+    if n_iter == "auto":
+        n_iter = 7 if r < .1*min(n,k) else 4
+    Omega = _np.random.default_rng(random_state).standard_normal((k,l),
+                                                                 dtype=dtype)
+
+    # Compute the mean and sketch X Omega in a single pass over X.
+    xbar = _np.zeros(n, dtype=dtype)
+    Y = _np.zeros((n,l), dtype=dtype)
+    for s in range(0, k, block):
+        Xblock = X[:,s:s+block]
+        xbar += _np.sum(Xblock, axis=1)
+        Y += Xblock @ Omega[s:s+block]
+    xbar /= k
+    Y -= _np.outer(xbar, _np.sum(Omega, axis=0))
+
+    # Power iterations with the implicitly shifted data X - xbar 1^T.
+    Q = _la.qr(Y, mode="economic")[0]
+    for _ in range(n_iter):
+        Q = _la.qr(X.T @ Q - xbar @ Q, mode="economic")[0]
+        Q = _la.qr(X @ Q - _np.outer(xbar, _np.sum(Q, axis=0)),
+                   mode="economic")[0]
+
+    # Compute the SVD of the small projected matrix B = Q^T (X - xbar 1^T).
+    B = (Q.T @ X - (Q.T @ xbar).reshape((-1,1))).astype(_np.float64)
+    Ub = _la.svd(B, full_matrices=False)[0]
+    return xbar, Q @ Ub[:,:r].astype(dtype)
+
+
 # Reduced dimension selection =================================================
-def significant_svdvals(X, eps, plot=False):
+def _svdvals(X, dtype=None):
+    """Compute the singular values of X (in descending order) with the gesdd
+    LAPACK driver, after casting X to dtype if it is given.
+    """
+    if dtype is not None:
+        X = X.astype(dtype, copy=False)
+    return _la.svd(X, compute_uv=False, lapack_driver="gesdd")
+
+
+def _significant_ranks(singular_values, eps):
+    """Count the number of singular_values greater than each value in eps.
+    Since the singular values are sorted in descending order, each count is
+    found with a binary search instead of a full scan.
+    """
+    ranks = _np.searchsorted(-singular_values, -_np.asarray(eps), side="left")
+    return [int(r) for r in ranks]
+
+
+def _energy_ranks(singular_values, thresh):
+    """Compute the cumulative energy of the singular values and the number of
+    singular values needed to surpass each energy threshold in thresh.
+    """
+    svdvals2 = singular_values**2
+    cumulative_energy = _np.cumsum(svdvals2) / _np.sum(svdvals2)
+    ranks = [_np.searchsorted(cumulative_energy, th) + 1 for th in thresh]
+    return cumulative_energy, ranks
+
+
+def significant_svdvals(X, eps, plot=False, dtype=None):
     """Count the number of singular values of X that are greater than eps.
 
     Parameters
@@ -97,6 +361,12 @@ def significant_svdvals(X, eps, plot=False):
         If True, plot the singular values and the cutoff value(s) against the
         singular value index.
 
+    dtype : numpy data type or None
+        If given (e.g., numpy.float32), cast X to this type before computing
+        its singular values. Single precision roughly halves the time and
+        memory of the SVD, at the cost of accuracy (about 1e-6 relative to
+        the largest singular value), which is usually enough to choose a rank.
+
     Returns
     -------
     ranks : int or list(int)
@@ -107,14 +377,15 @@ def significant_svdvals(X, eps, plot=False):
         raise ValueError("data X must be two-dimensional")
 
     # Calculate the number of singular values above the cutoff value(s).
-    singular_values = _la.svdvals(X)
+    singular_values = _svdvals(X, dtype)
     one_eps = _np.isscalar(eps)
     if one_eps:
         eps = [eps]
-    ranks = [_np.count_nonzero(singular_values > ep) for ep in eps]
+    ranks = _significant_ranks(singular_values, eps)
 
     if plot:
         # Visualize singular values and cutoff value(s).
+        from matplotlib import pyplot as _plt   # Only import if plotting.
         fig, ax = _plt.subplots(1, 1, figsize=(12,4))
         j = _np.arange(1, singular_values.size + 1)
         ax.semilogy(j, singular_values, 'C0*', ms=4, zorder=3)
@@ -131,7 +402,7 @@ def significant_svdvals(X, eps, plot=False):
     return ranks[0] if one_eps else ranks
 
 
-def energy_capture(X, thresh, plot=False):
+def energy_capture(X, thresh, plot=False, dtype=None):
     """Compute the number of singular values of X needed to surpass a given
     energy threshold. The energy of j singular values is defined by
 
@@ -149,6 +420,12 @@ def energy_capture(X, thresh, plot=False):
         If True, plot the singular values and the energy capture against
         the singular value index.
 
+    dtype : numpy data type or None
+        If given (e.g., numpy.float32), cast X to this type before computing
+        its singular values. Single precision roughly halves the time and
+        memory of the SVD, at the cost of accuracy (about 1e-6 relative to
+        the largest singular value), which is usually enough to choose a rank.
+
     Returns
     -------
     ranks : int or list(int)
@@ -159,19 +436,17 @@ def energy_capture(X, thresh, plot=False):
     if X.ndim != 2:
         raise ValueError("data X must be two-dimensional")
 
-    # Calculate singular values and cumulative energy.
-    singular_values = _la.svdvals(X)
-    svdvals2 = singular_values**2
-    cumulative_energy = _np.cumsum(svdvals2) / _np.sum(svdvals2)
-
-    # Determine the points at which the cumulative energy passes the threshold.
+    # Calculate singular values and cumulative energy, and determine the
+    # points at which the cumulative energy passes the threshold(s).
+    singular_values = _svdvals(X, dtype)
     one_thresh = _np.isscalar(thresh)
     if one_thresh:
         thresh = [thresh]
-    ranks = [_np.searchsorted(cumulative_energy, th) + 1 for th in thresh]
+    cumulative_energy, ranks = _energy_ranks(singular_values, thresh)
 
     if plot:
         # Visualize cumulative energy and threshold value(s).
+        from matplotlib import pyplot as _plt   # Only import if plotting.
         fig, ax = _plt.subplots(1, 1, figsize=(12,4))
         j = _np.arange(1, singular_values.size + 1)
         ax.semilogy(j, cumulative_energy, 'C2.-', ms=4, zorder=3)
@@ -188,12 +463,109 @@ def energy_capture(X, thresh, plot=False):
     return ranks[0] if one_thresh else ranks
 
 
+def svd_diagnostics(X, eps=None, thresh=None, dtype=None):
+    """Compute the results of significant_svdvals() and energy_capture() with
+    a single singular value decomposition of X. Use this instead of calling
+    both functions when both rank estimates are needed.
+
+    Parameters
+    ----------
+    X : (n,k) ndarray
+        A matrix of k snapshots. Each column is a single snapshot.
+
+    eps : float or list(floats) or None
+        Cutoff value(s) for the singular values of X.
+
+    thresh : float or list(floats) or None
+        Energy capture threshold(s).
+
+    dtype : numpy data type or None
+        If given (e.g., numpy.float32), cast X to this type before computing
+        its singular values. Single precision roughly halves the time and
+        memory of the SVD, at the cost of accuracy (about 1e-6 relative to
+        the largest singular value), which is usually enough to choose a rank.
+
+    Returns
+    -------
+    eps_ranks : int or list(int) or None
+        The number of singular values greater than the cutoff value(s), i.e.,
+        significant_svdvals(X, eps). None if eps is None.
+
+    thresh_ranks : int or list(int) or None
+        The number of singular values required to capture more than each
+        energy capture threshold, i.e., energy_capture(X, thresh). None if
+        thresh is None.
+    """
+    # Check dimensions.
+    if X.ndim != 2:
+        raise ValueError("data X must be two-dimensional")
+
+    singular_values = _svdvals(X, dtype)
+
+    eps_ranks = None
+    if eps is not None:
+        one_eps = _np.isscalar(eps)
+        eps_ranks = _significant_ranks(singular_values,
+                                       [eps] if one_eps else eps)
+        if one_eps:
+            eps_ranks = eps_ranks[0]
+
+    thresh_ranks = None
+    if thresh is not None:
+        one_thresh = _np.isscalar(thresh)
+        thresh_ranks = _energy_ranks(singular_values,
+                                     [thresh] if one_thresh else thresh)[1]
+        if one_thresh:
+            thresh_ranks = thresh_ranks[0]
+
+    return eps_ranks, thresh_ranks
+
+
+# Number of entries of X above which _reduce() works on blocks of columns,
+# and the number of columns in each block.
+_BLOCK_MIN_SIZE = 200000000
+_BLOCK_COLUMNS = 8192
+
+
+def _reduce(Vr, X):
+    """Compute Vr^T X. For very large two-dimensional X, the product is
+    computed one block of columns at a time so that each block of X stays in
+    the cache, instead of with a single matrix product.
+
+    Parameters
+    ----------
+    Vr : (n,r) ndarray
+        The reduced basis of rank r. Each column is one basis vector.
+
+    X : (n,k) or (n,) ndarray
+        A matrix of k snapshots or a single snapshot.
+
+    Returns
+    -------
+    W : (r,k) or (r,) ndarray
+        The product Vr^T X.
+    """
+    if X.ndim != 2 or X.size <= _BLOCK_MIN_SIZE:
+        return Vr.T @ X
+
+    k = X.shape[1]
+    W = _np.empty((Vr.shape[1], k), dtype=_np.result_type(Vr, X))
+    for s in range(0, k, _BLOCK_COLUMNS):
+        W[:,s:s+_BLOCK_COLUMNS] = Vr.T @ X[:,s:s+_BLOCK_COLUMNS]
+    return W
+
+
 def projection_error(X, Vr):
     """Calculate the projection error induced by the reduced basis Vr, given by
 
         err = ||X - Vr Vr^T X|| / ||X||,
 
-    since (Vr Vr^T) is the orthogonal projector onto the range of Vr.
+    since (Vr Vr^T) is the orthogonal projector onto the range of Vr. The
+    residual X - Vr Vr^T X is usually not formed; instead, the error is
+    computed with the identity ||X - Vr Vr^T X||^2 = ||X||^2 - ||Vr^T X||^2,
+    which requires Vr to have orthonormal columns (as is the case for
+    pod_basis()). If the error is small enough (below about 1e-4) that this
+    subtraction loses accuracy, the residual is formed directly instead.
 
     Parameters
     ----------
@@ -202,14 +574,21 @@ def projection_error(X, Vr):
         single 1D snapshot. If 2D, use the Frobenius norm; if 1D, the l2 norm.
 
     Vr : (n,r) ndarray
-        The reduced basis of rank r. Each column is one basis vector.
+        The reduced basis of rank r, with orthonormal columns. Each column is
+        one basis vector.
 
     Returns
     -------
     error : float
         The projection error.
     """
-    return _la.norm(X - Vr @ Vr.T @ X) / _la.norm(X)
+    X_norm = _la.norm(X)
+    W = _reduce(Vr, X)
+    residual2 = X_norm**2 - _la.norm(W)**2
+    if residual2 < 1e-8 * X_norm**2:
+        # Avoid cancellation by computing the (small) residual directly.
+        return _la.norm(X - Vr @ W) / X_norm
+    return _np.sqrt(residual2) / X_norm
 
 
 def minimal_projection_error(X, eps, rmax=_np.inf, plot=False, **options):
@@ -256,17 +635,22 @@ def minimal_projection_error(X, eps, rmax=_np.inf, plot=False, **options):
     if one_eps:
         eps = [eps]
 
-    errors = []
+    # Since V has orthonormal columns, ||X - Vr Vr^T X||_F^2 is equal to
+    # ||X - V V^T X||_F^2 plus the squared norms of rows r+1,...,rmax of V^T X,
+    # so only one residual is formed. Summing these nonnegative terms (rather
+    # than subtracting from ||X||_F^2) avoids cancellation for small errors.
     rs = _np.arange(1, rmax)
-    for j,r in enumerate(rs):
-        # Get the POD basis of rank r and calculate the projection error.
-        Vr = V[:,:r]
-        errors.append(_la.norm(X - Vr @ Vr.T @ X, ord="fro") / X_norm)
-    # Calculate the ranks needed to get under each cutoff value.
-    errors = _np.array(errors)
-    ranks = [_np.count_nonzero(errors > ep)+1 for ep in eps]
+    W = _reduce(V, X)
+    residual2 = _la.norm(X - V @ W, ord="fro")**2
+    tails2 = _np.cumsum(_np.sum(W**2, axis=1)[::-1])[::-1]
+    errors = _np.sqrt(residual2 + tails2[1:rmax]) / X_norm
+
+    # Calculate the ranks needed to get under each cutoff value. The errors
+    # decrease with r, so each rank is found with a binary search.
+    ranks = [int(r)+1 for r in _np.searchsorted(-errors, -_np.asarray(eps))]
 
     if plot:
+        from matplotlib import pyplot as _plt   # Only import if plotting.
         fig, ax = _plt.subplots(1, 1, figsize=(12,4))
         ax.semilogy(rs, errors, 'C1.-', ms=4, zorder=3)
         ax.set_xlim((0,rs.size))
@@ -315,25 +699,27 @@ def reproject_discrete(f, Vr, x0, niters, U=None):
         raise ValueError("basis Vr and initial condition x0 not aligned")
 
     # Create the solution array and fill in the initial condition.
-    Pr = Vr @ Vr.T                          # Projector onto linear subspace.
+    # The projector Vr Vr^T is applied as Vr (Vr^T x), which costs O(nr)
+    # instead of O(n^2) and never forms an (n,n) matrix.
+    VrT = Vr.T
     X_rp = _np.empty((n,niters))
-    X_rp[:,0] = Pr @ x0
+    X_rp[:,0] = Vr @ (VrT @ x0)
 
     # Run the re-projection iteration.
     if U is None:
         for j in range(niters-1):
-            X_rp[:,j+1] = Pr @ f(X_rp[:,j])
+            X_rp[:,j+1] = Vr @ (VrT @ f(X_rp[:,j]))
     elif U.ndim == 1:
         for j in range(niters-1):
-            X_rp[:,j+1] = Pr @ f(X_rp[:,j], U[j])
+            X_rp[:,j+1] = Vr @ (VrT @ f(X_rp[:,j], U[j]))
     else:
         for j in range(niters-1):
-            X_rp[:,j+1] = Pr @ f(X_rp[:,j], U[:,j])
+            X_rp[:,j+1] = Vr @ (VrT @ f(X_rp[:,j], U[:,j]))
 
     return X_rp
 
 
-def reproject_continuous(f, Vr, X, U=None):
+def reproject_continuous(f, Vr, X, U=None, batched=False):
     """Sample with re-projection trajectories of the continuous system of ODEs
 
         dx / dt = f(t, x(t), u(t)),     x(0) = x0.
@@ -352,6 +738,13 @@ def reproject_continuous(f, Vr, X, U=None):
     U : (m,k) ndarray
         Control inputs corresponding to the state trajectories.
 
+    batched : bool
+        If True, evaluate f once on all of the re-projected states at once,
+        i.e., f(X_reprojected) or f(X_reprojected, U). In this case, f must
+        map an (n,k) ndarray of states (and the full U array) to the (n,k)
+        ndarray whose jth column is the right-hand side evaluated at the jth
+        state. If False (default), call f separately on each column.
+
     Returns
     -------
     X_reprojected : (n,k) ndarray
@@ -368,7 +761,13 @@ def reproject_continuous(f, Vr, X, U=None):
     _,k = X.shape
 
     # Create the solution arrays.
-    X_rp = Vr @ Vr.T @ X
+    X_rp = Vr @ _reduce(Vr, X)
+    if batched:
+        Xdot_rp = f(X_rp) if U is None else f(X_rp, U)
+        if _np.shape(Xdot_rp) != X.shape:
+            raise ValueError("batched f must return an array of shape "
+                             f"{X.shape}, got {_np.shape(Xdot_rp)}")
+        return X_rp, Xdot_rp
     Xdot_rp = _np.empty_like(X)
 
     # Run the re-projection iteration.
@@ -386,39 +785,125 @@ def reproject_continuous(f, Vr, X, U=None):
 
 
 # Derivative approximation ====================================================
-def _fwd4(y, dt):                                           # pragma: no cover
-    """Compute the first derivative of a uniformly-spaced-in-time array with a
-    fourth-order forward difference scheme.
+# Forward difference coefficients (times dt) for the first derivative.
+_FWD4 = _np.array([-25, 48, -36, 16, -3]) / 12
+_FWD6 = _np.array([-147, 360, -450, 400, -225, 72, -10]) / 60
+
+# Backward difference coefficients (times dt), applied to the s entries
+# ending at the point of interest: the forward stencils reversed and negated.
+_BWD4 = -_FWD4[::-1].copy()
+_BWD6 = -_FWD6[::-1].copy()
+
+# Central difference coefficients (times dt) for the first derivative.
+_CEN4 = _np.array([1, -8, 0, 8, -1]) / 12
+_CEN6 = _np.array([-1, 9, -45, 0, 45, -9, 1]) / 60
+
+# Central / forward stencils for each order, and the minimum number of
+# entries of X for which xdot_uniform() uses the compiled kernel (below this,
+# the NumPy implementation is at least as fast).
+_STENCILS = {4: (_CEN4, _FWD4), 6: (_CEN6, _FWD6)}
+_JIT_MIN_SIZE = 100000
+
+
+def _xdot_boundaries(X, dt, forward, backward, nbdry, Xdot):
+    """Fill in the first and last nbdry columns of Xdot with one-sided
+    (forward on the front, backward on the end) difference approximations.
+    Each side is a single product of the stencil with a zero-copy view of the
+    sliding windows of X, so X is never transposed, reversed, or copied.
 
     Parameters
     ----------
-    y : (5,...) ndarray
-        Data to differentiate. The derivative is taken along the first axis.
+    X : (n,k) ndarray
+        Data to differentiate along the second axis. Must have k >= nbdry+s-1
+        columns; this is not checked here (see xdot_uniform()).
 
-    Returns
-    -------
-    dy0 : float or (...) ndarray
-        Approximate derivative of y at the first entry, i.e., dy[0] / dt.
+    dt : float
+        The time step between the snapshots.
+
+    forward : (s,) ndarray
+        Forward difference coefficients (times dt), e.g., _FWD4 or _FWD6.
+
+    backward : (s,) ndarray
+        Backward difference coefficients (times dt), e.g., _BWD4 or _BWD6.
+
+    nbdry : int
+        The number of boundary columns on each side.
+
+    Xdot : (n,k) ndarray
+        Array in which to store the boundary derivatives (modified in place).
     """
-    return (-25*y[0] + 48*y[1] - 36*y[2] + 16*y[3] - 3*y[4]) / (12*dt)
+    k, s = X.shape[1], forward.size
+    front = _sliding_window_view(X[:,:nbdry+s-1], s, axis=1)
+    back = _sliding_window_view(X[:,k-nbdry-s+1:], s, axis=1)
+    Xdot[:,:nbdry] = (front @ forward) / dt                     # Forward
+    Xdot[:,-nbdry:] = (back @ backward) / dt                    # Backward
+
+
+# Loop used by _xdot_stencil() over the rows of X. This is replaced with
+# numba.prange by _xdot_stencil_compiled() so that the rows run in parallel.
+_prange = range
+
+# Compiled version of _xdot_stencil(): None if not yet compiled, False if
+# Numba is not installed. Use _xdot_stencil_compiled() to access it.
+_xdot_stencil_jit = None
 
 
-def _fwd6(y, dt):                                           # pragma: no cover
-    """Compute the first derivative of a uniformly-spaced-in-time array with a
-    sixth-order forward difference scheme.
+def _xdot_stencil(X, dt, central, forward, Xdot):
+    """Apply a central difference stencil on the interior and forward /
+    backward difference stencils on the boundaries of each row of X. This is
+    compiled with Numba by _xdot_stencil_compiled() when it is installed, and
+    then runs in parallel over the rows of X.
 
     Parameters
     ----------
-    y : (7,...) ndarray
-        Data to differentiate. The derivative is taken along the first axis.
+    X : (n,k) ndarray
+        Data to differentiate along the second axis.
 
-    Returns
-    -------
-    dy0 : float or (...) ndarray
-        Approximate derivative of y at the first entry, i.e., dy[0] / dt.
+    dt : float
+        The time step between the snapshots.
+
+    central : (2h+1,) ndarray
+        Central difference coefficients (times dt), e.g., _CEN4 or _CEN6.
+
+    forward : (s,) ndarray
+        Forward difference coefficients (times dt), e.g., _FWD4 or _FWD6.
+
+    Xdot : (n,k) ndarray
+        Array in which to store the derivatives (modified in place).
+    """
+    n,k = X.shape
+    h = central.size // 2
+    for i in _prange(n):
+        for j in range(h, k-h):
+            total = 0.0
+            for m in range(central.size):
+                total += central[m] * X[i,j-h+m]
+            Xdot[i,j] = total / dt
+        for j in range(h):
+            front, back = 0.0, 0.0
+            for m in range(forward.size):
+                front += forward[m] * X[i,j+m]
+                back += forward[m] * X[i,k-1-j-m]
+            Xdot[i,j] = front / dt
+            Xdot[i,k-1-j] = -back / dt
+
+
+def _xdot_stencil_compiled():
+    """Return _xdot_stencil() compiled with Numba, or None if Numba is not
+    installed. Numba is only imported (and the kernel is only compiled) the
+    first time this is called, so it does not slow down importing this module.
     """
-    return (-147*y[0] + 360*y[1] - 450*y[2] + 400*y[3] - 225*y[4] \
-                                              + 72*y[5] - 10*y[6]) / (60*dt)
+    global _prange, _xdot_stencil_jit
+    if _xdot_stencil_jit is None:
+        try:
+            import numba
+        except ImportError:                                 # pragma: no cover
+            _xdot_stencil_jit = False
+            return None
+        _prange = numba.prange
+        _xdot_stencil_jit = numba.njit(parallel=True, fastmath=True,
+                                       cache=True)(_xdot_stencil)
+    return _xdot_stencil_jit or None
 
 
 def xdot_uniform(X, dt, order=2):
@@ -437,6 +922,8 @@ def xdot_uniform(X, dt, order=2):
     order : int {2, 4, 6}
         The order of the derivative approximation.
         See https://en.wikipedia.org/wiki/Finite_difference_coefficient.
+        For orders 4 and 6, large float32 or float64 arrays are
+        differentiated with a compiled kernel if Numba is installed.
 
     Returns
     -------
@@ -453,16 +940,28 @@ def xdot_uniform(X, dt, order=2):
     if order == 2:
         return _np.gradient(X, dt, edge_order=2, axis=1)
 
+    # Check that there are enough snapshots for the one-sided stencils.
+    if order in _STENCILS:
+        nbdry, s = order // 2, _STENCILS[order][1].size
+        if X.shape[1] < nbdry + s - 1:
+            raise ValueError(f"at least {nbdry + s - 1} snapshots required "
+                             f"for order {order}, got {X.shape[1]}")
+
     Xdot = _np.empty_like(X)
-    n,k = X.shape
+    if order in _STENCILS and X.dtype in (_np.float32, _np.float64) \
+                          and X.size >= _JIT_MIN_SIZE:
+        # Use the compiled kernel for large single / double precision data.
+        kernel = _xdot_stencil_compiled()
+        if kernel is not None:
+            kernel(X, float(dt), *_STENCILS[order], Xdot)
+            return Xdot
+
     if order == 4:
         # Central difference on interior
         Xdot[:,2:-2] = (X[:,:-4] - 8*X[:,1:-3] + 8*X[:,3:-1] - X[:,4:])/(12*dt)
 
-        # Forward difference on the front.
-        for j in range(2):
-            Xdot[:,j] = _fwd4(X[:,j:j+5].T, dt)                 # Forward
-            Xdot[:,-j-1] = -_fwd4(X[:,-j-5:k-j].T[::-1], dt)    # Backward
+        # Forward / backward differences on the front / end.
+        _xdot_boundaries(X, dt, _FWD4, _BWD4, 2, Xdot)
 
     elif order == 6:
         # Central difference on interior
@@ -470,9 +969,7 @@ def xdot_uniform(X, dt, order=2):
                         + 45*X[:,4:-2] - 9*X[:,5:-1] + X[:,6:]) / (60*dt)
 
         # Forward / backward differences on the front / end.
-        for j in range(3):
-            Xdot[:,j] = _fwd6(X[:,j:j+7].T, dt)                 # Forward
-            Xdot[:,-j-1] = -_fwd6(X[:,-j-7:k-j].T[::-1], dt)    # Backward
+        _xdot_boundaries(X, dt, _FWD6, _BWD6, 3, Xdot)
 
     else:
         raise NotImplementedError(f"invalid order '{order}'; "
@@ -481,7 +978,7 @@ def xdot_uniform(X, dt, order=2):
     return Xdot
 
 
-def xdot_nonuniform(X, t):
+def xdot_nonuniform(X, t, force_nonuniform=False):
     """Approximate the time derivatives for a chunk of snapshots with a
     second-order finite difference scheme.
 
@@ -496,54 +993,57 @@ def xdot_nonuniform(X, t):
         See xdot_uniform() for higher-order computation in the case of
         evenly-spaced-in-time snapshots.
 
+    force_nonuniform : bool
+        If False (default) and the entries of t are evenly spaced (up to the
+        rounding error of t, a relative tolerance of 8 * t.size * machine
+        epsilon), use the faster xdot_uniform() with the time step
+        t[1] - t[0]. If True, always use the nonuniform scheme.
+
     Returns
     -------
     Xdot : (n,k) ndarray
         Approximate time derivative of the snapshot data. The jth column is
         the derivative dx / dt corresponding to the jth snapshot, X[:,j].
     """
-    # Check dimensions.
+    # Check dimensions and input types.
     if X.ndim != 2:
         raise ValueError("data X must be two-dimensional")
+    if not isinstance(t, _np.ndarray):
+        raise TypeError("time t must be an array (e.g., numpy.ndarray)")
     if t.ndim != 1:
         raise ValueError("time t must be one-dimensional")
     if X.shape[-1] != t.shape[0]:
         raise ValueError("data X not aligned with time t")
 
+    # Use the uniform scheme if the time steps are all the same.
+    if not force_nonuniform:
+        dts = _np.diff(t)
+        eps = _np.finfo(_np.result_type(t, float)).eps
+        if dts.size > 1 and _np.ptp(dts) <= 8*t.size*eps*abs(dts[0]):
+            return xdot_uniform(X, dts[0])
+
     # Compute the derivative with a second-order difference scheme.
     return _np.gradient(X, t, edge_order=2, axis=-1)
 
 
-def xdot(X, *args, **kwargs):
-    """Approximate the time derivatives for a chunk of snapshots with a finite
-    difference scheme. Calls xdot_uniform() or xdot_nonuniform(), depending on
-    the arguments.
-
-    Parameters
-    ----------
-    X : (n,k) ndarray
-        The data to estimate the derivative of. The jth column is a snapshot
-        that corresponds to the jth time step, i.e., X[:,j] = x(t[j]).
-
-    Additional parameters
-    ---------------------
-    dt : float
-        The time step between the snapshots, i.e., t[j+1] - t[j] = dt.
-    order : int {2, 4, 6} (optional)
-        The order of the derivative approximation.
-        See https://en.wikipedia.org/wiki/Finite_difference_coefficient.
-
-    OR
-
-    t : (k,) ndarray
-        The times corresponding to the snapshots. May or may not be uniformly
-        spaced.
-
-    Returns
-    -------
-    Xdot : (n,k) ndarray
-        Approximate time derivative of the snapshot data. The jth column is
-        the derivative dx / dt corresponding to the jth snapshot, X[:,j].
+# Argument patterns of xdot() mapped directly to the function to call.
+_XDOT_DISPATCH = {
+    (0, ("dt",)):                   xdot_uniform,
+    (0, ("dt", "order")):           xdot_uniform,
+    (0, ("t",)):                    xdot_nonuniform,
+    (0, ("force_nonuniform", "t")): xdot_nonuniform,
+    (1, (), float):                 xdot_uniform,
+    (1, (), _np.float64):           xdot_uniform,
+    (1, (), _np.ndarray):           xdot_nonuniform,
+    (1, ("order",)):                xdot_uniform,
+    (1, ("force_nonuniform",)):     xdot_nonuniform,
+    (2, ()):                        xdot_uniform,
+}
+
+
+def _xdot_select(args, kwargs):
+    """Choose xdot_uniform() or xdot_nonuniform() for argument patterns that
+    are not in _XDOT_DISPATCH, raising an informative error for invalid ones.
     """
     n_args = len(args)          # Number of positional arguments (excluding X).
     n_kwargs = len(kwargs)      # Number of keyword arguments.
@@ -578,14 +1078,62 @@ def xdot(X, *args, **kwargs):
         raise TypeError("xdot() takes from 2 to 3 positional arguments "
                         f"but {n_total+1} were given")
 
+    return func
+
+
+def xdot(X, *args, **kwargs):
+    """Approximate the time derivatives for a chunk of snapshots with a finite
+    difference scheme. Calls xdot_uniform() or xdot_nonuniform(), depending on
+    the arguments.
+
+    Parameters
+    ----------
+    X : (n,k) ndarray
+        The data to estimate the derivative of. The jth column is a snapshot
+        that corresponds to the jth time step, i.e., X[:,j] = x(t[j]).
+
+    Additional parameters
+    ---------------------
+    dt : float
+        The time step between the snapshots, i.e., t[j+1] - t[j] = dt.
+    order : int {2, 4, 6} (optional)
+        The order of the derivative approximation.
+        See https://en.wikipedia.org/wiki/Finite_difference_coefficient.
+
+    OR
+
+    t : (k,) ndarray
+        The times corresponding to the snapshots. May or may not be uniformly
+        spaced.
+    force_nonuniform : bool (optional)
+        See xdot_nonuniform().
+
+    Returns
+    -------
+    Xdot : (n,k) ndarray
+        Approximate time derivative of the snapshot data. The jth column is
+        the derivative dx / dt corresponding to the jth snapshot, X[:,j].
+    """
+    # Look up the common argument patterns first; the key is the number of
+    # positional arguments, the sorted keyword names, and (for a single
+    # positional argument) its type.
+    key = (len(args), tuple(sorted(kwargs)))
+    if key == (1, ()):
+        key += (type(args[0]),)
+    func = _XDOT_DISPATCH.get(key)
+    if func is None:
+        func = _xdot_select(args, kwargs)
+
     return func(X, *args, **kwargs)
 
 
 __all__ = [
             "mean_shift",
             "pod_basis",
+            "pod_basis_centered",
             "significant_svdvals",
             "energy_capture",
+            "svd_diagnostics",
             "projection_error",
             "minimal_projection_error",
             "reproject_discrete",
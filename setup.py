@@ -34,12 +34,12 @@ setuptools.setup(
     # Technical details: source code, dependencies, test suite.
     packages=["rom_operator_inference"],
     install_requires=[
-        "numpy>=1.16",
+        "numpy>=1.20",
         "scipy>=1.3",
-        "scikit-learn>=0.18",
         "matplotlib>=3.1",
         "python>=3.7",
       ],
+    extras_require={"numba": ["numba>=0.45"]},
     setup_requires=["pytest-runner"],
     test_suite="pytest",
     tests_require=["pytest"],
@@ -19,7 +19,7 @@ def set_up_basis_data():
 
 
 def test_pod_basis(set_up_basis_data):
-    """Test pre.pod_basis() on a small case with the ARPACK solver."""
+    """Test pre.pod_basis() on a small case with each solver."""
     X = set_up_basis_data
     n,k = X.shape
     r = k // 10
@@ -44,11 +44,68 @@ def test_pod_basis(set_up_basis_data):
             Vr[:,j] = -Vr[:,j]
     assert np.allclose(Vr, Ur)
 
-    # Via sklearn.utils.extmath.randomized_svd().
-    Vr = roi.pre.pod_basis(X, r, mode="randomized")
+    # Via scipy.sparse.linalg.svds() (PROPACK).
+    Vr = roi.pre.pod_basis(X, r, mode="arpack", solver="propack")
     assert Vr.shape == (n,r)
+    for j in range(r):              # Make sure the columns have the same sign.
+        if not np.isclose(Ur[0,j], Vr[0,j]):
+            Vr[:,j] = -Vr[:,j]
+    assert np.allclose(Vr, Ur)
+
+    # Via randomized SVD (the default).
+    Vr = roi.pre.pod_basis(X, r)
+    assert Vr.shape == (n,r)
+    assert np.allclose(Vr.T @ Vr, np.eye(r))
     # No accuracy test, since that is not guaranteed by randomized SVD.
 
+    # Randomized SVD with a fixed seed is reproducible.
+    Vr = roi.pre.pod_basis(X, r, mode="randomized", random_state=42)
+    Vr2 = roi.pre.pod_basis(X, r, mode="randomized", random_state=42)
+    assert np.all(Vr == Vr2)
+
+    # Cached randomized sketches are reused for smaller r.
+    X_ = X.copy()
+    Vr = roi.pre.pod_basis(X_, r, cache=True)
+    Vr2 = roi.pre.pod_basis(X_, r//2, cache=True)
+    assert np.all(Vr2 == Vr[:,:r//2])
+    Vr2 = roi.pre.pod_basis(X_, r//2, cache=False)
+    assert not np.all(Vr2 == Vr[:,:r//2])
+
+    # The cache is not used after X is modified or for a larger r.
+    X_[0,0] += 1
+    Vr2 = roi.pre.pod_basis(X_, r//2, cache=True)
+    assert not np.all(Vr2 == Vr[:,:r//2])
+    l = roi.pre._SKETCH_CACHE["Q"].shape[1]
+    Vr = roi.pre.pod_basis(X_, r+5, cache=True)
+    assert Vr.shape == (n,r+5)
+    assert roi.pre._SKETCH_CACHE["Q"].shape[1] > l
+
+    # The cache is only reused for the same random_state.
+    Vr = roi.pre.pod_basis(X_, r, random_state=0, cache=True)
+    Vr2 = roi.pre.pod_basis(X_, r, random_state=0, cache=True)
+    assert np.all(Vr2 == Vr)
+    Vr2 = roi.pre.pod_basis(X_, r, random_state=1, cache=True)
+    assert not np.all(Vr2 == Vr)
+    assert np.all(Vr2 == roi.pre.pod_basis(X_, r, random_state=1))
+
+    # The cache works on non-contiguous views and is emptied with X.
+    X_ = X_[:,::2]
+    Vr = roi.pre.pod_basis(X_, r, cache=True)
+    assert np.all(roi.pre.pod_basis(X_, r//2, cache=True) == Vr[:,:r//2])
+    del X_
+    assert not roi.pre._SKETCH_CACHE
+
+    # Randomized SVD recovers the basis of a matrix of exact rank r.
+    Y = X[:,:r] @ np.random.random((r,k))
+    Ur = la.svd(Y, full_matrices=False)[0][:,:r]
+    Vr = roi.pre.pod_basis(Y, r, n_oversamples=5, n_iter=2)
+    assert np.allclose(Vr @ (Vr.T @ Ur), Ur)
+
+    # Single precision data gives a single precision basis.
+    Vr = roi.pre.pod_basis(Y.astype(np.float32), r, n_oversamples=5)
+    assert Vr.dtype == np.float32
+    assert np.allclose(Vr @ (Vr.T @ Ur), Ur, atol=1e-4)
+
 
 def test_mean_shift(set_up_basis_data):
     """Test pre.mean_shift()."""
@@ -64,6 +121,59 @@ def test_mean_shift(set_up_basis_data):
         roi.pre.mean_shift(np.random.random((3,3,3)))
     assert exc.value.args[0] == "data X must be two-dimensional"
 
+    # Shift in place.
+    X_ = X.copy()
+    xbar_, Xshifted_ = roi.pre.mean_shift(X_, inplace=True)
+    assert Xshifted_ is X_
+    assert np.allclose(xbar_, xbar)
+    assert np.allclose(Xshifted_, Xshifted)
+
+    # Try to shift integer data in place.
+    with pytest.raises(TypeError) as exc:
+        roi.pre.mean_shift(np.ones((3,3), dtype=int), inplace=True)
+    assert exc.value.args[0] == \
+        "data X must be floating point to shift in place"
+
+
+def test_pod_basis_centered(set_up_basis_data):
+    """Test pre.pod_basis_centered()."""
+    X = set_up_basis_data
+    n,k = X.shape
+    r = k // 10
+
+    # Try with bad data shape.
+    with pytest.raises(ValueError) as exc:
+        roi.pre.pod_basis_centered(np.ravel(X), r)
+    assert exc.value.args[0] == "data X must be two-dimensional"
+
+    # Data with a nonzero mean and a shifted part of exact rank r.
+    Y = X[:,:r] @ np.random.random((r,k)) + 5*np.random.random((n,1))
+    xbar, Yshifted = roi.pre.mean_shift(Y)
+    Ur = roi.pre.pod_basis(Yshifted, r, mode="simple")
+    for block in [k, 64]:
+        xbar_, Vr = roi.pre.pod_basis_centered(Y, r, block=block)
+        assert xbar_.shape == (n,)
+        assert Vr.shape == (n,r)
+        assert np.allclose(xbar_, xbar)
+        assert np.allclose(Vr.T @ Vr, np.eye(r))
+        assert np.allclose(Vr @ (Vr.T @ Ur), Ur)
+
+    # Matches the two-step route with the same seed and power iterations,
+    # also for data that is not exactly low rank.
+    Z = X + 5*np.random.random((n,1))
+    Zshifted = roi.pre.mean_shift(Z)[1]
+    for n_iter in ["auto", 2]:
+        Vr = roi.pre.pod_basis_centered(Z, r, n_iter=n_iter, random_state=7)[1]
+        Wr = roi.pre.pod_basis(Zshifted, r, mode="randomized",
+                               n_iter=n_iter, random_state=7)
+        assert np.allclose(Vr @ Vr.T, Wr @ Wr.T)
+
+    # Single precision data.
+    xbar_, Vr = roi.pre.pod_basis_centered(Y.astype(np.float32), r)
+    assert xbar_.dtype == np.float32 and Vr.dtype == np.float32
+    assert np.allclose(xbar_, xbar, atol=1e-4)
+    assert np.allclose(Vr @ (Vr.T @ Ur), Ur, atol=1e-4)
+
 
 # Reduced dimension selection =================================================
 def test_significant_svdvals(set_up_basis_data):
@@ -86,6 +196,10 @@ def test_significant_svdvals(set_up_basis_data):
         assert isinstance(r, int) and r >= 1
     assert rs == sorted(rs)
 
+    # Single precision.
+    r = roi.pre.significant_svdvals(X, 1e-4, dtype=np.float32)
+    assert r == roi.pre.significant_svdvals(X, 1e-4)
+
     # Plotting.
     status = plt.isinteractive()
     plt.ion()
@@ -117,6 +231,10 @@ def test_energy_capture(set_up_basis_data):
         assert isinstance(r, np.int64) and r >= 1
     assert rs == sorted(rs)
 
+    # Single precision.
+    rs32 = roi.pre.energy_capture(X, [.9, .99, .999], dtype=np.float32)
+    assert all(abs(r32 - r) <= 1 for r32,r in zip(rs32, rs))
+
     # Plotting.
     status = plt.isinteractive()
     plt.ion()
@@ -128,6 +246,49 @@ def test_energy_capture(set_up_basis_data):
     plt.close("all")
 
 
+def test_svd_diagnostics(set_up_basis_data):
+    """Test pre.svd_diagnostics()."""
+    X = set_up_basis_data
+
+    # Try with bad data shape.
+    with pytest.raises(ValueError) as exc:
+        roi.pre.svd_diagnostics(np.ravel(X), 1e-14, .99)
+    assert exc.value.args[0] == "data X must be two-dimensional"
+
+    # Nothing requested.
+    assert roi.pre.svd_diagnostics(X) == (None, None)
+
+    # Single cutoff / threshold.
+    r1, r2 = roi.pre.svd_diagnostics(X, eps=1e-4, thresh=.9)
+    assert r1 == roi.pre.significant_svdvals(X, 1e-4)
+    assert r2 == roi.pre.energy_capture(X, .9)
+
+    # Multiple cutoffs / thresholds.
+    epss, threshs = [1e-4, 1e-8, 1e-12], [.9, .99, .999]
+    rs1, rs2 = roi.pre.svd_diagnostics(X, eps=epss, thresh=threshs)
+    assert rs1 == roi.pre.significant_svdvals(X, epss)
+    assert rs2 == roi.pre.energy_capture(X, threshs)
+    assert roi.pre.svd_diagnostics(X, thresh=threshs) == (None, rs2)
+    r1, _ = roi.pre.svd_diagnostics(X, eps=1e-4, dtype=np.float32)
+    assert r1 == roi.pre.significant_svdvals(X, 1e-4)
+
+
+def test_reduce(set_up_basis_data, monkeypatch):
+    """Test pre._reduce()."""
+    X = set_up_basis_data
+    Vr = la.svd(X, full_matrices=False)[0][:,:X.shape[1]//3]
+    W = Vr.T @ X
+    assert np.allclose(roi.pre._reduce(Vr, X), W)
+    assert np.allclose(roi.pre._reduce(Vr, X[:,0]), W[:,0])
+
+    # Force the blocked computation.
+    monkeypatch.setattr(roi.pre, "_BLOCK_MIN_SIZE", 0)
+    monkeypatch.setattr(roi.pre, "_BLOCK_COLUMNS", 64)
+    assert np.allclose(roi.pre._reduce(Vr, X), W)
+    assert np.isclose(roi.pre.projection_error(X, Vr),
+                      la.norm(X - Vr @ W) / la.norm(X))
+
+
 def test_projection_error(set_up_basis_data):
     """Test pre.projection_error()."""
     X = set_up_basis_data
@@ -135,6 +296,33 @@ def test_projection_error(set_up_basis_data):
 
     err = roi.pre.projection_error(X, Vr)
     assert np.isscalar(err) and err >= 0
+    assert np.isclose(err, la.norm(X - Vr @ Vr.T @ X) / la.norm(X))
+
+    # Errors near machine precision.
+    Y = X[:,:100] * np.logspace(0, -14, 100)
+    Vr = la.svd(Y, full_matrices=False)[0][:,:70]
+    err = roi.pre.projection_error(Y, Vr)
+    assert np.isclose(err, la.norm(Y - Vr @ Vr.T @ Y) / la.norm(Y),
+                      rtol=1e-6, atol=0)
+
+    # Errors on both sides of the cutoff for forming the residual directly.
+    n,k = X.shape
+    U = la.qr(X, mode="economic")[0]
+    W = la.qr(np.random.random((k,k)))[0]
+    for tail in [1.5e-6, 3e-6, 5e-5, 2e-4, 1e-3]:
+        svals = np.concatenate(([1.0]*(k//2), [tail]*(k - k//2)))
+        Y = (U * svals) @ W
+        Vr = U[:,:k//2]
+        err = roi.pre.projection_error(Y, Vr)
+        assert np.isclose(err, la.norm(Y - Vr @ (Vr.T @ Y)) / la.norm(Y),
+                          rtol=1e-6, atol=0)
+    Vr = la.svd(X, full_matrices=False)[0][:,:X.shape[1]//3]
+
+    # One-dimensional data.
+    err = roi.pre.projection_error(X[:,0], Vr)
+    assert np.isscalar(err) and err >= 0
+    assert np.isclose(err, la.norm(X[:,0] - Vr @ Vr.T @ X[:,0])
+                           / la.norm(X[:,0]))
 
 
 def test_minimal_projection_error(set_up_basis_data):
@@ -157,6 +345,17 @@ def test_minimal_projection_error(set_up_basis_data):
         assert isinstance(r, int) and r >= 1
     assert rs == sorted(rs)
 
+    # Compare to the direct projection errors for small cutoffs.
+    k = 200
+    Y = X[:500,:k] * np.logspace(0, -14, k)
+    V = la.svd(Y, full_matrices=False)[0]
+    errors = np.array([la.norm(Y - V[:,:r] @ V[:,:r].T @ Y) / la.norm(Y)
+                       for r in range(1, k)])
+    epss = [1e-6, 1e-8, 1e-10, 1e-12]
+    rs = roi.pre.minimal_projection_error(Y, epss, mode="simple")
+    assert rs == [np.count_nonzero(errors > ep)+1 for ep in epss]
+    assert rs[-1] < k - 1
+
     # Plotting
     status = plt.isinteractive()
     plt.ion()
@@ -284,6 +483,29 @@ def test_reproject_continuous(n=100, m=20, r=10):
     assert np.allclose(model.A_, Vr.T @ A @ Vr)
     assert np.allclose(model.B_, Vr.T @ B)
 
+    # Batched evaluation agrees with column-by-column evaluation.
+    f = lambda x: A @ x
+    X_, Xdot_ = roi.pre.reproject_continuous(f, Vr, X)
+    Xb, Xdotb = roi.pre.reproject_continuous(f, Vr, X, batched=True)
+    assert np.allclose(Xb, X_) and np.allclose(Xdotb, Xdot_)
+
+    f = lambda x, u: A @ x + B1d * u
+    fb = lambda x, u: A @ x + np.outer(B1d, u)
+    X_, Xdot_ = roi.pre.reproject_continuous(f, Vr, X, U1d)
+    Xb, Xdotb = roi.pre.reproject_continuous(fb, Vr, X, U1d, batched=True)
+    assert np.allclose(Xb, X_) and np.allclose(Xdotb, Xdot_)
+
+    f = lambda x, u: A @ x + B @ u
+    X_, Xdot_ = roi.pre.reproject_continuous(f, Vr, X, U)
+    Xb, Xdotb = roi.pre.reproject_continuous(f, Vr, X, U, batched=True)
+    assert np.allclose(Xb, X_) and np.allclose(Xdotb, Xdot_)
+
+    # Try with a batched function that returns the wrong shape.
+    with pytest.raises(ValueError) as exc:
+        roi.pre.reproject_continuous(lambda x: x[:,0], Vr, X, batched=True)
+    assert exc.value.args[0] == \
+        f"batched f must return an array of shape {(n,k)}, got {(n,)}"
+
     # Quadratic case, no inputs.
     f = lambda x: A @ x + H @ np.kron(x,x)
     X, Xdot = roi.pre.reproject_continuous(f, Vr, X)
@@ -330,44 +552,83 @@ def set_up_nonuniform_difference_data():
     return _difference_data(t)
 
 
-def test_fwd4(set_up_uniform_difference_data):
-    """Test pre._fwd4()."""
+def test_stencils(set_up_uniform_difference_data):
+    """Test the one-sided difference coefficients pre._FWD4, pre._FWD6,
+    pre._BWD4, and pre._BWD6, and pre._xdot_boundaries().
+    """
     dynamicstate = set_up_uniform_difference_data
     t, Y, dY = dynamicstate.time, dynamicstate.state, dynamicstate.derivative
     dt = t[1] - t[0]
-    for j in range(Y.shape[1] - 5):
-        # One-dimensional test.
-        dY0 = roi.pre._fwd4(Y[0,j:j+5], dt)
-        assert isinstance(dY0, float)
-        assert np.isclose(dY0, dY[0,j])
-
-        # Two-dimensional test.
-        dYj = roi.pre._fwd4(Y[:,j:j+5].T, dt)
-        assert dYj.shape == Y[:,j].shape
-        assert np.allclose(dYj, dY[:,j])
-
-        # Check agreement.
-        assert dY0 == dYj[0]
-
-
-def test_fwd6(set_up_uniform_difference_data):
-    """Test pre._fwd6()."""
+    k = Y.shape[1]
+    windows = np.lib.stride_tricks.sliding_window_view
+    for fwd, bwd, nbdry in [(roi.pre._FWD4, roi.pre._BWD4, 2),
+                            (roi.pre._FWD6, roi.pre._BWD6, 3)]:
+        s = fwd.size
+
+        # Forward differences at every point but the last s-1.
+        assert np.allclose(windows(Y, s, axis=1) @ fwd / dt, dY[:,:k-s+1])
+
+        # Backward differences at every point but the first s-1.
+        assert np.allclose(windows(Y, s, axis=1) @ bwd / dt, dY[:,s-1:])
+
+        # Boundary columns.
+        Ydot = np.zeros_like(Y)
+        roi.pre._xdot_boundaries(Y, dt, fwd, bwd, nbdry, Ydot)
+        assert np.allclose(Ydot[:,:nbdry], dY[:,:nbdry])
+        assert np.allclose(Ydot[:,-nbdry:], dY[:,-nbdry:])
+        assert np.all(Ydot[:,nbdry:-nbdry] == 0)
+
+        # Shortest allowed data: the front and back windows overlap.
+        kmin = nbdry + s - 1
+        Ydot = np.empty_like(Y[:,:kmin])
+        roi.pre._xdot_boundaries(Y[:,:kmin], dt, fwd, bwd, nbdry, Ydot)
+        for j in range(nbdry):
+            assert np.allclose(Ydot[:,j], Y[:,j:j+s] @ fwd / dt)
+            assert np.allclose(Ydot[:,kmin-nbdry+j],
+                               Y[:,kmin-nbdry+j-s+1:kmin-nbdry+j+1] @ bwd / dt)
+
+
+def test_xdot_stencil(set_up_uniform_difference_data):
+    """Test pre._xdot_stencil() and its compiled version."""
     dynamicstate = set_up_uniform_difference_data
     t, Y, dY = dynamicstate.time, dynamicstate.state, dynamicstate.derivative
     dt = t[1] - t[0]
-    for j in range(Y.shape[1] - 7):
-        # One-dimensional test.
-        dY0 = roi.pre._fwd6(Y[0,j:j+7], dt)
-        assert isinstance(dY0, float)
-        assert np.isclose(dY0, dY[0,j])
-
-        # Two-dimensional test.
-        dYj = roi.pre._fwd6(Y[:,j:j+7].T, dt).T
-        assert dYj.shape == Y[:,j].shape
-        assert np.allclose(dYj, dY[:,j])
-
-        # Check agreement.
-        assert dY0 == dYj[0]
+    for o in [4, 6]:
+        dY_ = roi.pre.xdot_uniform(Y, dt, order=o)
+        kernels = [roi.pre._xdot_stencil]
+        if roi.pre._xdot_stencil_compiled() is not None:
+            kernels.append(roi.pre._xdot_stencil_compiled())
+        for kernel in kernels:
+            out = np.empty_like(Y)
+            kernel(Y, dt, *roi.pre._STENCILS[o], out)
+            assert np.allclose(out, dY_)
+
+    # Large data goes through the compiled kernel (if available).
+    Z = np.tile(Y, (roi.pre._JIT_MIN_SIZE // Y.size + 1, 1))
+    for o in [4, 6]:
+        dZ_ = roi.pre.xdot_uniform(Z, dt, order=o)
+        assert np.allclose(dZ_[:Y.shape[0]], roi.pre.xdot_uniform(Y, dt, o))
+
+    # Too few snapshots for the stencil, on both the compiled (large n) and
+    # the NumPy (small n) paths.
+    for o, kmin in [(4, 6), (6, 9)]:
+        for n in [10, roi.pre._JIT_MIN_SIZE]:
+            for k in [3, kmin - 1]:
+                with pytest.raises(ValueError) as exc:
+                    roi.pre.xdot_uniform(np.random.random((n,k)), dt, order=o)
+                assert exc.value.args[0] == \
+                    f"at least {kmin} snapshots required for order {o}, got {k}"
+        W = np.random.random((roi.pre._JIT_MIN_SIZE, kmin))
+        dW_ = roi.pre.xdot_uniform(W, dt, order=o)
+        assert np.allclose(dW_[:10], roi.pre.xdot_uniform(W[:10], dt, o))
+
+    # Large data of other floating point types uses NumPy.
+    for dtype in [np.float16, np.longdouble]:
+        Zt = Z.astype(dtype)
+        dZ_ = roi.pre.xdot_uniform(Zt, dt, order=4)
+        assert dZ_.dtype == dtype
+        assert np.all(dZ_[:Y.shape[0]] ==
+                      roi.pre.xdot_uniform(Y.astype(dtype), dt, order=4))
 
 
 def test_xdot_uniform(set_up_uniform_difference_data):
@@ -385,6 +646,14 @@ def test_xdot_uniform(set_up_uniform_difference_data):
         roi.pre.xdot_uniform(Y[:,0], dt, order=2)
     assert exc.value.args[0] == "data X must be two-dimensional"
 
+    # Try with too few snapshots.
+    for o, kmin in [(4, 6), (6, 9)]:
+        for k in range(1, kmin):
+            with pytest.raises(ValueError) as exc:
+                roi.pre.xdot_uniform(Y[:,:k], dt, order=o)
+            assert exc.value.args[0] == \
+                f"at least {kmin} snapshots required for order {o}, got {k}"
+
     # Try with bad order.
     with pytest.raises(NotImplementedError) as exc:
         roi.pre.xdot_uniform(Y, dt, order=-1)
@@ -409,6 +678,11 @@ def test_xdot_nonuniform(set_up_nonuniform_difference_data):
         roi.pre.xdot_nonuniform(Y[:,0], t)
     assert exc.value.args[0] == "data X must be two-dimensional"
 
+    # Try with bad time type.
+    with pytest.raises(TypeError) as exc:
+        roi.pre.xdot_nonuniform(Y, .1)
+    assert exc.value.args[0] == "time t must be an array (e.g., numpy.ndarray)"
+
     # Try with bad time shape.
     with pytest.raises(ValueError) as exc:
         roi.pre.xdot_nonuniform(Y, np.dstack((t,t)))
@@ -418,6 +692,25 @@ def test_xdot_nonuniform(set_up_nonuniform_difference_data):
         roi.pre.xdot_nonuniform(Y, np.hstack((t,t)))
     assert exc.value.args[0] == "data X not aligned with time t"
 
+    # Uniformly spaced times use the uniform scheme unless told otherwise.
+    t = np.linspace(0, 1, Y.shape[1])
+    dt = t[1] - t[0]
+    dY_ = roi.pre.xdot_nonuniform(Y, t)
+    assert np.allclose(dY_, roi.pre.xdot_uniform(Y, dt))
+    dY_ = roi.pre.xdot_nonuniform(Y, t, force_nonuniform=True)
+    assert np.allclose(dY_, np.gradient(Y, t, edge_order=2, axis=-1))
+
+    # Long, evenly spaced times also use the uniform scheme.
+    t = np.linspace(0, 1, 20000)
+    Z = np.sin(np.outer(np.arange(1, 4), t))
+    dZ_ = roi.pre.xdot_nonuniform(Z, t)
+    assert np.all(dZ_ == roi.pre.xdot_uniform(Z, t[1] - t[0]))
+
+    # Times that are not evenly spaced do not.
+    t[10] += 1e-3 * (t[1] - t[0])
+    dZ_ = roi.pre.xdot_nonuniform(Z, t)
+    assert np.all(dZ_ == np.gradient(Z, t, edge_order=2, axis=-1))
+
 
 def test_xdot(set_up_uniform_difference_data,
               set_up_nonuniform_difference_data):
@@ -447,6 +740,8 @@ def test_xdot(set_up_uniform_difference_data,
 
     _single_test(Y, t)
     _single_test(Y, t=t)
+    _single_test(Y, t, force_nonuniform=True)
+    _single_test(Y, t=t, force_nonuniform=True)
 
     # Try with bad arguments.
     with pytest.raises(TypeError) as exc:
@@ -469,6 +764,10 @@ def test_xdot(set_up_uniform_difference_data,
     assert exc.value.args[0] == \
         "invalid argument type '<class 'int'>'"
 
+    with pytest.raises(TypeError) as exc:
+        roi.pre.xdot(Y, .1, force_nonuniform=True)
+    assert exc.value.args[0] == "time t must be an array (e.g., numpy.ndarray)"
+
     with pytest.raises(TypeError) as exc:
         roi.pre.xdot(Y, dt, 4, None)
     assert exc.value.args[0] == \